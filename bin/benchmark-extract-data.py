@@ -0,0 +1,319 @@
+# /usr/bin/env python
+
+# Benchmark the stages of extract-data.py against synthetic datasets.
+#
+# The real dataset can't be distributed so this generates a data folder that
+#  looks like it: an AIATSIS geography workbook, a Gambay geojson and a folder
+#  per language holding a 65 row workbook in the layout SheetVerifier expects
+#  with tiny audio and video stand-ins. Each dataset size is then run through
+#  DataExtractor one stage at a time in a fresh process (so nothing carries
+#  over between sizes) and the wall time, peak RSS (sampled while the stage
+#  runs) and files written by each stage are reported as json. Child
+#  processes (ffmpeg and the sheet workers) only report a high-water mark so
+#  theirs is the largest so far rather than per stage. Nothing is downloaded
+#  so it runs offline.
+#
+#  python3 bin/benchmark-extract-data.py --sizes 5,20,50 --output bench.json
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import math
+import os
+import os.path
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import zipfile
+from xml.sax.saxutils import escape
+
+STAGES = [
+    (
+        "geography load",
+        ["extract_aiatsis_geographies", "extract_gambay_geographies"],
+    ),
+    ("mapping", ["map_gambay_and_aiatsis_geographies"]),
+    ("overrides", ["apply_aiatsis_overrides"]),
+    ("sheet extraction", ["extract_language_data"]),
+    ("repository build", ["build_repository"]),
+    ("index writing", ["write_master_indices"]),
+]
+
+WORKBOOK_PARTS = {
+    "[Content_Types].xml": '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/><Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>',
+    "_rels/.rels": '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+    "xl/workbook.xml": '<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    "xl/_rels/workbook.xml.rels": '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/></Relationships>',
+}
+
+
+def write_workbook(path, rows):
+    # a minimal single sheet xlsx with inline strings - enough for xlrd
+    def cell(ref, value):
+        if isinstance(value, (int, float)):
+            return f'<c r="{ref}"><v>{value}</v></c>'
+        return f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+
+    xml = []
+    for r, row in enumerate(rows, 1):
+        cells = "".join(
+            cell(f"{chr(ord('A') + c)}{r}", value)
+            for c, value in enumerate(row)
+            if value != ""
+        )
+        xml.append(f'<row r="{r}">{cells}</row>')
+    sheet = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f'<sheetData>{"".join(xml)}</sheetData></worksheet>'
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, content in WORKBOOK_PARTS.items():
+            z.writestr(name, content)
+        z.writestr("xl/worksheets/sheet1.xml", sheet)
+
+
+def write_audio(path, seconds):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(os.urandom(2 * int(8000 * seconds)))
+
+
+def write_video(path):
+    # a real clip if ffmpeg is around, otherwise a placeholder that ffmpeg
+    #  will fail on (and the failure is reported like any other)
+    try:
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "panic",
+                "-y",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc=duration=1:size=64x64:rate=10",
+                path,
+            ],
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(os.urandom(1024))
+
+
+def generate_dataset(data_path, languages, seed=0):
+    random.seed(seed)
+    os.makedirs(data_path, exist_ok=True)
+    geography = [["Code", "Name", "", "Lat", "Lng", "", "", "Override"]]
+    features = []
+    for i in range(languages):
+        code = f"X{i:04d}"
+        name = f"Language {i}"
+        lat = random.uniform(-38, -12)
+        lng = random.uniform(115, 152)
+        geography.append([code, name, "", lat, lng, "", "", ""])
+
+        # most languages have a Gambay polygon, some without a code (so it
+        #  comes from AIATSIS) and the rest only exist in AIATSIS
+        if i % 5 != 4:
+            radius = random.uniform(0.2, 2)
+            ring = [
+                [
+                    lng + radius * math.cos(a / 64 * 2 * math.pi),
+                    lat + radius * math.sin(a / 64 * 2 * math.pi),
+                ]
+                for a in range(64)
+            ]
+            ring.append(ring[0])
+            properties = {"name": name}
+            if i % 5 != 3:
+                properties["code"] = code
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                    "properties": properties,
+                }
+            )
+
+        folder = os.path.join(data_path, name)
+        os.makedirs(folder, exist_ok=True)
+        rows = [
+            ["Language name", name, "language.wav"],
+            ["AIATSIS code", code],
+            ["Speaker's name", f"Speaker {i}", "speaker.wav"],
+            ["Other people who helped to get the list produced", "Helpers"],
+            ["Permission form received (Y/N)?", "Y"],
+            [],
+            ["Date received", "2019-07-01"],
+            ["English", "Indigenous", "File", "Alternate"],
+        ]
+        write_audio(os.path.join(folder, "language.wav"), 0.5)
+        write_audio(os.path.join(folder, "speaker.wav"), 0.5)
+        for w in range(57):
+            if i % 10 == 9 and w % 10 == 0:
+                media = f"word{w}.mov"
+                write_video(os.path.join(folder, media))
+            else:
+                media = f"word{w}.wav"
+                write_audio(os.path.join(folder, media), random.uniform(0.3, 1))
+            rows.append(
+                [
+                    f"word {w}",
+                    f"{name} {w}",
+                    media,
+                    f"alternate {w}" if w % 4 == 0 else "",
+                ]
+            )
+        write_workbook(os.path.join(folder, f"{name}.xlsx"), rows)
+
+    write_workbook(os.path.join(data_path, "AIATSIS-geography.xlsx"), geography)
+    with open(os.path.join(data_path, "gambay-languages.geojson"), "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        # no /proc - the high-water mark is the best there is
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# ru_maxrss never goes down so it can't tell stages apart - sample the
+#  resident set size while the stage runs instead
+@contextlib.contextmanager
+def sample_rss(interval=0.01):
+    peak = {"kb": current_rss_kb()}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak["kb"] = max(peak["kb"], current_rss_kb())
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield peak
+    finally:
+        done.set()
+        thread.join()
+        peak["kb"] = max(peak["kb"], current_rss_kb())
+
+
+def count_files(path):
+    return sum(len(files) for (root, dirs, files) in os.walk(path))
+
+
+def measure(data_path, repository):
+    spec = importlib.util.spec_from_file_location(
+        "extract_data", os.path.join(os.path.dirname(__file__), "extract-data.py")
+    )
+    extract_data = importlib.util.module_from_spec(spec)
+    # the sheet workers need to find it by name to unpickle read_language_sheet
+    sys.modules["extract_data"] = extract_data
+    spec.loader.exec_module(extract_data)
+
+    d = extract_data.DataExtractor(data_path=data_path, repository=repository)
+    d.manifest.load()
+    stages = []
+    for (name, methods) in STAGES:
+        files = count_files(repository)
+        start = time.perf_counter()
+        with sample_rss() as rss:
+            for method in methods:
+                getattr(d, method)()
+        stages.append(
+            {
+                "stage": name,
+                "wall_time": time.perf_counter() - start,
+                "peak_rss_kb": rss["kb"],
+                "peak_child_rss_so_far_kb": resource.getrusage(
+                    resource.RUSAGE_CHILDREN
+                ).ru_maxrss,
+                "files_written": count_files(repository) - files,
+            }
+        )
+    d.manifest.prune()
+    d.manifest.save()
+    return {"stages": stages, "errors": len(d.errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the extract-data.py stages on synthetic datasets"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="5,20,50",
+        help="comma separated numbers of languages to benchmark",
+    )
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument(
+        "--keep", help="generate the datasets and repositories in this folder"
+    )
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # full builds unless told otherwise
+    os.environ.setdefault("UPDATE_ALL", "true")
+
+    if args.measure:
+        # the extractor prints progress - keep stdout for the result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = measure(*args.measure)
+        print(json.dumps(result))
+        return
+
+    workspace = args.keep or tempfile.mkdtemp(prefix="50words-benchmark-")
+    report = {"date": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "runs": []}
+    try:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            data_path = os.path.join(workspace, f"data-{size}")
+            repository = os.path.join(workspace, f"dist-{size}", "repository")
+            shutil.rmtree(os.path.dirname(repository), ignore_errors=True)
+            if not os.path.exists(data_path):
+                generate_dataset(data_path, size)
+            os.makedirs(repository)
+
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, __file__, "--measure", data_path, repository],
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            report["runs"].append(
+                {
+                    "languages": size,
+                    "wall_time": time.perf_counter() - start,
+                    **json.loads(result.stdout),
+                }
+            )
+    finally:
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,166 @@
 
 import base64
 import coloredlogs
+import cProfile
+import ctypes
+import ctypes.util
+import fcntl
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from copy import deepcopy
 from datetime import datetime
 import json
 import hashlib
 import logging as log
+import math
 import os
 import os.path
+import pickle
 import pprint
-from shutil import copyfile
+import re
+import resource
+import select
+import sqlite3
+from shutil import copyfile, rmtree
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from types import SimpleNamespace
+import unicodedata
+import wave
 import xlrd
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 coloredlogs.install()
 pp = pprint.PrettyPrinter(compact=True)
 
 log.basicConfig(level=log.INFO)
 
+FICLONE = 0x40049409
+
+# The outputs made from each kind of recording, keyed by format (which is also
+#  the file extension). All of an input's outputs come from one ffmpeg run so
+#  it is only decoded once. Set TRANSCODE_PROFILES to a json file of the same
+#  shape to use different settings.
+TRANSCODE_PROFILES = {
+    "audio": {
+        "webm": {
+            "audio_codec": "libopus",
+            "audio_bitrate": "48k",
+            "sample_rate": 48000,
+            "channels": 1,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+        "mp3": {
+            "audio_codec": "libmp3lame",
+            "audio_bitrate": "64k",
+            "sample_rate": 44100,
+            "channels": 1,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+    },
+    "video": {
+        "webm": {
+            "video_codec": "libvpx-vp9",
+            "video_bitrate": "600k",
+            "pixel_format": "yuv420p",
+            "audio_codec": "libopus",
+            "audio_bitrate": "64k",
+            "sample_rate": 48000,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+        "mp4": {
+            "video_codec": "libx264",
+            "video_bitrate": "800k",
+            "pixel_format": "yuv420p",
+            "audio_codec": "aac",
+            "audio_bitrate": "96k",
+            "sample_rate": 44100,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+    },
+    # a still and a small low bitrate rendition of each video that the site
+    #  can show before (and while) the full one loads
+    "poster": {
+        "jpg": {
+            "video_codec": "mjpeg",
+            "video_filter": "thumbnail,scale=320:-2",
+            "quality": 4,
+            "frames": 1,
+            "pixel_format": "yuvj420p",
+        },
+        "webp": {
+            "video_codec": "libwebp",
+            "video_filter": "thumbnail,scale=320:-2",
+            "quality": 75,
+            "frames": 1,
+        },
+    },
+    "preview": {
+        "webm": {
+            "video_codec": "libvpx-vp9",
+            "video_bitrate": "150k",
+            "video_filter": "scale=320:-2",
+            "pixel_format": "yuv420p",
+            "audio_codec": "libopus",
+            "audio_bitrate": "32k",
+            "sample_rate": 48000,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+        "mp4": {
+            "video_codec": "libx264",
+            "video_bitrate": "200k",
+            "video_filter": "scale=320:-2",
+            "pixel_format": "yuv420p",
+            "audio_codec": "aac",
+            "audio_bitrate": "48k",
+            "sample_rate": 44100,
+            "loudnorm": "I=-16:TP=-1.5:LRA=11",
+        },
+    },
+}
+
+
+# The language sheets are a fixed 65 row by 4 column grid. Read it from the
+#  workbook once into a flat tuple so verification and extraction don't go back
+#  to xlrd for every cell. Cells beyond the edge of the sheet read as "".
+class SheetSnapshot:
+    __slots__ = ("nrows", "cells")
+    rows = 65
+    columns = 4
+
+    def __init__(self, sheet):
+        self.nrows = sheet.nrows
+        cells = [""] * (self.rows * self.columns)
+        for r in range(min(sheet.nrows, self.rows)):
+            values = sheet.row_values(r, 0, self.columns)
+            start = r * self.columns
+            cells[start : start + len(values)] = values
+        self.cells = tuple(cells)
+
+    @classmethod
+    def from_workbook(cls, path):
+        # on_demand only loads the first sheet (xlrd can't stream xlsx so it
+        #  falls back to a full read there) and everything is released as soon
+        #  as the snapshot has been taken
+        with xlrd.open_workbook(path, on_demand=True, ragged_rows=True) as wb:
+            return cls(wb.sheet_by_index(0))
+
+    def cell(self, row, column):
+        return self.cells[row * self.columns + column]
+
+    def row(self, row):
+        start = row * self.columns
+        return self.cells[start : start + self.columns]
+
 
 class SheetVerifier:
     def __init__(self, sheet, sheet_name):
@@ -44,28 +186,30 @@ class SheetVerifier:
         self.check(6, 0, "Date received")
         self.check(6, 1)
         for i in range(8, 65):
-            if self.sheet.row_values(i)[1] and not self.sheet.row_values(i)[2]:
+            (english, indigenous, media, alternate) = self.sheet.row(i)
+            if indigenous and not media:
                 self.errors.append(
                     {
                         "type": "Missing media file for word",
                         "level": "warning",
-                        "msg": f"'{self.sheet_name}': No media file for '{self.sheet.row_values(i)[1]}'.",
+                        "msg": f"'{self.sheet_name}': No media file for '{indigenous}'.",
                     }
                 )
 
         return self.errors
 
     def check(self, row, column, value=None):
-        if value and self.sheet.row_values(row)[column] != value:
+        cell = self.sheet.cell(row, column)
+        if value and cell != value:
             self.ok = False
             self.errors.append(
                 {
                     "type": "Sheet verification incorrect data",
                     "level": "error",
-                    "msg": f"'{self.sheet_name}': Unexpected value in row: {row}, column: {column}. Expected: {value}, Got: {self.sheet.row_values(row)[column]}",
+                    "msg": f"'{self.sheet_name}': Unexpected value in row: {row}, column: {column}. Expected: {value}, Got: {cell}",
                 }
             )
-        elif not self.sheet.row_values(row)[column]:
+        elif not cell:
             self.errors.append(
                 {
                     "type": "Sheet verification missing data",
@@ -75,8 +219,650 @@ class SheetVerifier:
             )
 
 
-class DataExtractor:
+# runs in a worker process so it must only depend on its arguments
+def read_language_sheet(root, sheet):
+    def parse_row(row):
+        data = {"english": row[0], "indigenous": row[1].lower()}
+        if ".mov" in row[2]:
+            data["video_file"] = row[2]
+        elif ".wav" in row[2]:
+            data["audio_file"] = row[2]
+
+        if row[3]:
+            data["english_alternate"] = row[3]
+        return data
+
+    errors = []
+    sh = SheetSnapshot.from_workbook(sheet)
+    if sh.nrows != 65:
+        errors.append(
+            {
+                "type": "Bad spreadsheet",
+                "level": "error",
+                "msg": f"'{sheet}' in '{root}' isn't exactly 65 rows - is it correct?",
+            }
+        )
+        return {"sheet": None, "errors": errors}
+
+    log.info(f"Verifying {sheet}")
+    v = SheetVerifier(sh, sheet)
+    errors.extend(v.verify())
+    if not v.ok:
+        log.error("Errors found in sheet - skipping this folder.")
+        return {"sheet": None, "errors": errors}
+
+    log.info(f"Extracting language data from {sheet}")
+    sheet = {
+        "language": {
+            "name": sh.cell(0, 1).strip(),
+            "audio_file": os.path.join(root, sh.cell(0, 2).strip())
+            if sh.cell(0, 2)
+            else "",
+        },
+        "date_received": sh.cell(6, 1),
+        "code": sh.cell(1, 1).strip(),
+        "words": [],
+        "speaker": {
+            "name": sh.cell(2, 1).strip(),
+            "audio_file": os.path.join(root, sh.cell(2, 2).strip())
+            if sh.cell(2, 2).strip()
+            else "",
+        },
+        "thankyou": sh.cell(3, 1).strip(),
+    }
+    for r in range(8, sh.nrows):
+        data = parse_row(sh.row(r))
+        if "audio_file" in data:
+            data["audio_file"] = os.path.join(root, data["audio_file"])
+        elif "video_file" in data:
+            data["video_file"] = os.path.join(root, data["video_file"])
+
+        sheet["words"].append(data)
+    return {"sheet": sheet, "errors": errors}
+
+
+# Douglas-Peucker line simplification. Points closer than tolerance to the
+#  line between the points kept either side of them are dropped.
+def simplify_line(points, tolerance):
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        (first, last) = stack.pop()
+        (x1, y1) = points[first][:2]
+        (x2, y2) = points[last][:2]
+        dx = x2 - x1
+        dy = y2 - y1
+        norm = dx * dx + dy * dy
+        index = None
+        furthest = tolerance * tolerance
+        for i in range(first + 1, last):
+            (x, y) = points[i][:2]
+            t = max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / norm)) if norm else 0
+            distance = (x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2
+            if distance > furthest:
+                index = i
+                furthest = distance
+        if index is not None:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for (p, k) in zip(points, keep) if k]
+
+
+def quantize_line(points, precision):
+    quantized = []
+    for point in points:
+        point = [round(point[0], precision), round(point[1], precision)]
+        if not quantized or quantized[-1] != point:
+            quantized.append(point)
+    return quantized
+
+
+def simplify_geometry(geometry, tolerance, precision):
+    def ring(points, required):
+        simplified = quantize_line(simplify_line(points, tolerance), precision)
+        if len(simplified) < required:
+            simplified = quantize_line(points, precision)
+        return simplified if len(simplified) >= required else None
+
+    def polygon(rings):
+        rings = [ring(r, 4) for r in rings]
+        if not rings or rings[0] is None:
+            return None
+        return [r for r in rings if r]
+
+    kind = geometry["type"]
+    coordinates = geometry["coordinates"]
+    if kind == "Point":
+        coordinates = quantize_line([coordinates], precision)[0]
+    elif kind == "MultiPoint":
+        coordinates = quantize_line(coordinates, precision)
+    elif kind == "LineString":
+        coordinates = ring(coordinates, 2)
+    elif kind == "MultiLineString":
+        coordinates = [r for r in [ring(c, 2) for c in coordinates] if r]
+    elif kind == "Polygon":
+        coordinates = polygon(coordinates)
+    elif kind == "MultiPolygon":
+        coordinates = [p for p in [polygon(c) for c in coordinates] if p]
+    else:
+        return None
+    return {"type": kind, "coordinates": coordinates} if coordinates else None
+
+
+def geometry_bounds(coordinates):
+    points = []
+    stack = [coordinates]
+    while stack:
+        item = stack.pop()
+        if not isinstance(item, list) or not item:
+            continue
+        if isinstance(item[0], (int, float)):
+            points.append(item)
+        else:
+            stack.extend(item)
+    if not points:
+        return None
+    lngs = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return (min(lngs), min(lats), max(lngs), max(lats))
+
+
+# web mercator (slippy map) tile containing the point at zoom
+def tile_at(lng, lat, zoom):
+    n = 2 ** zoom
+    lat = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lng + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+    return (min(max(x, 0), n - 1), min(max(y, 0), n - 1))
+
+
+# ffmpeg output options for a transcode profile. audio is the stream to map -
+#  the input's first audio stream (if it has one) unless a filter graph
+#  label is given, in which case the graph is expected to do the loudness
+#  normalisation itself.
+def profile_options(profile, audio="0:a:0?"):
+    options = []
+    if "video_codec" in profile:
+        options += ["-map", "0:v:0?", "-c:v", profile["video_codec"]]
+        if "video_bitrate" in profile:
+            options += ["-b:v", profile["video_bitrate"]]
+        if "quality" in profile:
+            options += ["-q:v", str(profile["quality"])]
+        if "video_filter" in profile:
+            options += ["-vf", profile["video_filter"]]
+        if "frames" in profile:
+            options += ["-frames:v", str(profile["frames"])]
+        if "pixel_format" in profile:
+            options += ["-pix_fmt", profile["pixel_format"]]
+    else:
+        options += ["-vn"]
+    if "audio_codec" not in profile:
+        # a still
+        return options + ["-an"]
+    options += ["-map", audio, "-c:a", profile["audio_codec"]]
+    options += ["-b:a", profile["audio_bitrate"], "-ar", str(profile["sample_rate"])]
+    if "channels" in profile:
+        options += ["-ac", str(profile["channels"])]
+    if profile.get("loudnorm") and not audio.startswith("["):
+        options += ["-af", f"loudnorm={profile['loudnorm']}"]
+    return options
+
+
+# length of a recording in seconds - read from the header of wav files and
+#  asked of ffprobe for anything else. None if it can't be worked out.
+def media_duration(path):
+    try:
+        with wave.open(path, "rb") as w:
+            return w.getnframes() / w.getframerate()
+    except (wave.Error, EOFError, OSError):
+        pass
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                path,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        return float(result.stdout)
+    except (OSError, ValueError):
+        return None
+
+
+# Inverted index over the english, english_alternate and indigenous spellings
+#  of every word. Normalised tokens and their character trigrams map to
+#  postings of (language, word slot, fields) flattened into one list of ints.
+#  It is sharded on the first character of each term so a client only needs to
+#  load the shards for what has been typed.
+class SearchIndex:
+    fields = ["english", "english_alternate", "indigenous"]
+    ngram = 3
+
     def __init__(self):
+        self.languages = []
+        self.terms = {"tokens": {}, "ngrams": {}}
+
+    @staticmethod
+    def normalise(text):
+        text = unicodedata.normalize("NFKD", str(text).casefold())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return re.findall(r"[^\W_]+", text)
+
+    def add(self, code, slot, word):
+        if not self.languages or self.languages[-1] != code:
+            self.languages.append(code)
+        language = len(self.languages) - 1
+        for (bit, field) in enumerate(self.fields):
+            for token in self.normalise(word.get(field, "")):
+                grams = {
+                    token[i : i + self.ngram]
+                    for i in range(len(token) - self.ngram + 1)
+                }
+                terms = [("tokens", token)] + [("ngrams", gram) for gram in grams]
+                for (kind, term) in terms:
+                    postings = self.terms[kind].setdefault(term, {})
+                    key = (language, slot)
+                    postings[key] = postings.get(key, 0) | (1 << bit)
+
+    def shards(self):
+        shards = {}
+        for kind, terms in self.terms.items():
+            for term in sorted(terms):
+                key = term[0] if term[0].isascii() and term[0].isalnum() else "_"
+                shard = shards.setdefault(key, {"tokens": {}, "ngrams": {}})
+                shard[kind][term] = [
+                    value
+                    for ((language, slot), fields) in sorted(terms[term].items())
+                    for value in (language, slot, fields)
+                ]
+        return shards
+
+
+# Per run instrumentation written to metrics.json next to errors.json: wall
+#  and cpu time and bytes read and written for each stage, every ffmpeg run and
+#  counts of outputs that were rebuilt or skipped as current.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = []
+        self.transcodes = []
+        self.counts = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @contextmanager
+    def stage(self, name):
+        log.info(f"Stage: {name}")
+        start = (
+            time.perf_counter(),
+            time.process_time(),
+            resource.getrusage(resource.RUSAGE_CHILDREN),
+            self.bytes_in,
+            self.bytes_out,
+        )
+        yield
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.stages.append(
+            {
+                "stage": name,
+                "wall_time": round(time.perf_counter() - start[0], 6),
+                "cpu_time": round(time.process_time() - start[1], 6),
+                "child_cpu_time": round(
+                    (children.ru_utime - start[2].ru_utime)
+                    + (children.ru_stime - start[2].ru_stime),
+                    6,
+                ),
+                "bytes_in": self.bytes_in - start[3],
+                "bytes_out": self.bytes_out - start[4],
+            }
+        )
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def read(self, n):
+        with self.lock:
+            self.bytes_in += n
+
+    def wrote(self, n):
+        with self.lock:
+            self.bytes_out += n
+
+    def transcode(self, item, format, duration, status, bytes_in, bytes_out):
+        with self.lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.transcodes.append(
+                {
+                    "file": item,
+                    "format": format,
+                    "duration": round(duration, 6),
+                    "status": status,
+                    "bytes_in": bytes_in,
+                    "bytes_out": bytes_out,
+                }
+            )
+
+    def report(self):
+        return {
+            "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "stages": self.stages,
+            "counts": dict(sorted(self.counts.items())),
+            "transcodes": self.transcodes,
+        }
+
+
+# Maps every output in the repository to the content hashes of its inputs and
+#  the settings it was built with so that only changed work is redone. Outputs
+#  that are not claimed again during a run are removed by prune().
+class BuildManifest:
+    def __init__(self, repository):
+        self.repository = repository
+        self.path = os.path.join(repository, ".build-manifest.json")
+        self.sheet_cache = os.path.join(repository, ".sheet-cache")
+        self.read_only = False
+        self.unsaved_sheets = {}
+        self.fresh = True
+        self.files = {}
+        self.outputs = {}
+        self.sheets = {}
+        self.media = []
+        self.seen_files = set()
+        self.seen_outputs = set()
+        self.seen_sheets = set()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        self.fresh = False
+        self.files = manifest["files"]
+        self.outputs = manifest["outputs"]
+        self.sheets = manifest["sheets"]
+        self.media = manifest.get("media", [])
+
+    def save(self):
+        manifest = {
+            "files": {k: v for k, v in self.files.items() if k in self.seen_files},
+            "outputs": self.outputs,
+            "sheets": self.sheets,
+            "media": self.media,
+        }
+        with open(f"{self.path}.tmp", "w") as f:
+            f.write(json.dumps(manifest))
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if (
+            not cached
+            or cached["size"] != stat.st_size
+            or cached["mtime"] != stat.st_mtime_ns
+        ):
+            m = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    m.update(chunk)
+            cached = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": m.hexdigest(),
+            }
+            self.files[path] = cached
+        self.seen_files.add(path)
+        return cached["sha256"]
+
+    def duration(self, path):
+        # cached with the file's hash so it's only probed again if it changes
+        self.file_hash(path)
+        cached = self.files[path]
+        if "duration" not in cached:
+            duration = media_duration(path)
+            if duration is None:
+                return None
+            cached["duration"] = duration
+        return cached["duration"]
+
+    def signature(self, inputs, settings):
+        return {
+            "inputs": {path: self.file_hash(path) for path in inputs},
+            "settings": settings,
+        }
+
+    def is_current(self, target, signature, adopt=False):
+        # adopt trusts an existing file that predates the manifest
+        key = os.path.relpath(target, self.repository)
+        self.seen_outputs.add(key)
+        if key not in self.outputs:
+            if adopt and self.fresh and os.path.exists(target):
+                self.outputs[key] = signature
+                return True
+            return False
+        return self.outputs[key] == signature and os.path.exists(target)
+
+    def record(self, target, signature):
+        key = os.path.relpath(target, self.repository)
+        self.seen_outputs.add(key)
+        self.outputs[key] = signature
+
+    def forget(self, target):
+        self.outputs.pop(os.path.relpath(target, self.repository), None)
+
+    # Extractions are only reused for the same sheet read by the same script.
+    #  They're kept in a file per sheet rather than in the manifest so only
+    #  the ones in use are ever in memory.
+    def sheet_file(self, path):
+        name = hashlib.sha256(path.encode()).hexdigest()
+        return os.path.join(self.sheet_cache, f"{name}.json")
+
+    def sheet_current(self, path, digest, script):
+        self.seen_sheets.add(path)
+        cached = self.sheets.get(path)
+        return (
+            cached is not None
+            and cached["sha256"] == digest
+            and cached.get("script") == script
+            and os.path.exists(self.sheet_file(path))
+        )
+
+    def load_sheet(self, path):
+        if path in self.unsaved_sheets:
+            return self.unsaved_sheets[path]
+        with open(self.sheet_file(path), "r") as f:
+            return json.load(f)
+
+    def record_sheet(self, path, digest, script, result):
+        self.seen_sheets.add(path)
+        if self.read_only:
+            # nowhere to keep it but in memory
+            self.unsaved_sheets[path] = result
+            return
+        os.makedirs(self.sheet_cache, exist_ok=True)
+        with open(f"{self.sheet_file(path)}.tmp", "w") as f:
+            json.dump(result, f)
+        os.replace(f"{self.sheet_file(path)}.tmp", self.sheet_file(path))
+        self.sheets[path] = {"sha256": digest, "script": script}
+
+    def prune(self):
+        for key in sorted(set(self.outputs) - self.seen_outputs):
+            target = os.path.join(self.repository, key)
+            log.info(f"Removing {target} - no longer referenced")
+            try:
+                os.remove(target)
+                os.removedirs(os.path.dirname(target))
+            except OSError:
+                pass
+            del self.outputs[key]
+        for path in set(self.sheets) - self.seen_sheets:
+            try:
+                os.remove(self.sheet_file(path))
+            except FileNotFoundError:
+                pass
+        self.sheets = {k: v for k, v in self.sheets.items() if k in self.seen_sheets}
+
+
+# Yields the paths under a folder that have changed, a burst at a time: once
+#  a change arrives it waits until nothing else has changed for debounce
+#  seconds. Uses inotify and falls back to polling file sizes and mtimes where
+#  that isn't available.
+class DataWatcher:
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    EVENTS = (
+        IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    )
+
+    def __init__(self, path, debounce=2.0, interval=2.0):
+        self.path = path
+        self.debounce = debounce
+        self.interval = interval
+        self.watches = {}
+        self.fd = None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+            if self.fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            self.watch_tree(path)
+        except (OSError, AttributeError) as e:
+            log.warning(f"Can't use inotify ({e}) - polling {path} instead")
+            if self.fd is not None and self.fd >= 0:
+                os.close(self.fd)
+            self.fd = None
+            self.snapshot = self.scan()
+
+    def watch_tree(self, path):
+        # returns the files already in there (ie a folder that was moved in)
+        files = set()
+        for root, dirs, names in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.EVENTS)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Can't watch {root}")
+            self.watches[wd] = root
+            files.update(os.path.join(root, name) for name in names)
+        return files
+
+    def scan(self):
+        snapshot = {}
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        # the paths that change within timeout seconds (None waits for ever)
+        if self.fd is None:
+            time.sleep(self.interval if timeout is None else timeout)
+            snapshot = self.scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            return changed
+
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        buffer = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            (wd, mask, cookie, length) = struct.unpack_from("iIII", buffer, offset)
+            name = os.fsdecode(buffer[offset + 16 : offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were dropped - treat everything as changed
+                changed.add(self.path)
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            path = os.path.join(self.watches.get(wd, self.path), name)
+            changed.add(path)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                try:
+                    changed.update(self.watch_tree(path))
+                except OSError as e:
+                    log.warning(f"{e} - changes in there will be missed")
+        return changed
+
+    def __iter__(self):
+        while True:
+            changed = self.poll(None)
+            while changed:
+                more = self.poll(self.debounce)
+                if not more:
+                    break
+                changed |= more
+            if changed:
+                yield changed
+
+
+# Builds the repository and then rebuilds it whenever the data changes. A
+#  change to the geography data rebuilds everything, anything else just the
+#  languages whose folders changed.
+def watch():
+    d = DataExtractor()
+    watcher = DataWatcher(
+        d.data_path, debounce=float(os.environ.get("WATCH_DEBOUNCE") or 2)
+    )
+    geography = {
+        d.data_path,
+        f"{d.data_path}/AIATSIS-geography.xlsx",
+        d.gambay_geographies_geojson,
+    }
+    changes = iter(watcher)
+    previous = None
+    changed = None
+    while True:
+        if previous and changed & geography:
+            log.info("Geography data changed - rebuilding everything")
+            previous = None
+        d = DataExtractor()
+        d.watching = True
+        try:
+            d.extract(previous, changed)
+            previous = d
+        except Exception:
+            log.exception("Build failed - the next change rebuilds everything")
+            previous = None
+        log.info(f"Watching {d.data_path} for changes")
+        changed = next(changes)
+        log.info(f"{len(changed)} files changed")
+
+
+class DataExtractor:
+    def __init__(self, data_path="/srv/data", repository="/srv/dist/repository"):
         self.aiatsis_geographies = {}
         self.gambay_geographies = {}
         self.data = {}
@@ -84,18 +870,241 @@ class DataExtractor:
         self.languages = {}
         self.gambay_additions = []
         self.errors = []
-        self.data_path = "/srv/data"
-        self.repository = "/srv/dist/repository"
-        self.gambay_geographies_geojson = "/srv/data/gambay-languages.geojson"
-
-    def extract(self):
-        self.extract_aiatsis_geographies()
-        self.extract_gambay_geographies()
-        self.map_gambay_and_aiatsis_geographies()
-        self.apply_aiatsis_overrides()
-        self.extract_language_data()
-        self.build_repository()
-        self.write_master_indices()
+        # by language code - the repository moves with STAGED_PUBLISH
+        self.build_errors = {}
+        self.previous_errors = {}
+        self.sheet_codes = {}
+        self.sheet_paths = {}
+        self.rebuild = None
+        self.geography = None
+        self.watching = False
+        self.search = SearchIndex()
+        self.metrics = Metrics()
+        self.data_path = data_path
+        self.gambay_geographies_geojson = f"{data_path}/gambay-languages.geojson"
+        self.published = repository
+        self.use_repository(repository)
+        self.media_produced = set()
+        self.brotli = os.environ.get("BROTLI") == "true"
+        self.hashed_filenames = os.environ.get("HASHED_FILENAMES") == "true"
+        self.assets = {}
+        self.compact_words = os.environ.get("COMPACT_WORDS") == "true"
+        self.audio_sprites = os.environ.get("AUDIO_SPRITES") == "true"
+        self.sprite_padding = 0.5
+        self.staged_publish = os.environ.get("STAGED_PUBLISH") == "true"
+        self.keep_versions = int(os.environ.get("KEEP_VERSIONS") or 2)
+        self.transcode_profiles = TRANSCODE_PROFILES
+        if os.environ.get("TRANSCODE_PROFILES"):
+            with open(os.environ["TRANSCODE_PROFILES"], "r") as f:
+                self.transcode_profiles = json.load(f)
+        if self.brotli and not brotli:
+            log.warning("BROTLI is set but the brotli module isn't installed")
+            self.brotli = False
+        self.tile_zooms = [
+            int(zoom)
+            for zoom in (os.environ.get("TILE_ZOOMS") or "3,5,7").split(",")
+        ]
+        self.sheet_workers = int(os.environ.get("SHEET_WORKERS") or os.cpu_count() or 1)
+        self.transcode_workers = int(
+            os.environ.get("TRANSCODE_WORKERS") or os.cpu_count() or 1
+        )
+
+    def extract(self, previous=None, changed=None):
+        # previous and changed come from watch mode: the extractor from the
+        #  last run and the paths that have changed since. The geography is
+        #  then reused and only the languages in changed folders are rebuilt.
+        if not self.staged_publish:
+            self.build(previous, changed)
+            return
+        self.stage_repository()
+        try:
+            self.build(previous, changed)
+        except BaseException:
+            # a half built version would otherwise take the place of a good
+            #  one when the old versions are pruned
+            log.error(f"Removing unpublished version {self.repository}")
+            rmtree(self.repository, ignore_errors=True)
+            raise
+        self.publish_repository()
+
+    def build(self, previous=None, changed=None):
+        self.manifest.load()
+        if previous:
+            with self.metrics.stage("geography load"):
+                self.restore_geography(previous.geography)
+        elif not self.load_geography_snapshot():
+            with self.metrics.stage("geography load"):
+                self.extract_aiatsis_geographies()
+                self.extract_gambay_geographies()
+            with self.metrics.stage("mapping"):
+                self.map_gambay_and_aiatsis_geographies()
+            with self.metrics.stage("overrides"):
+                self.apply_aiatsis_overrides()
+            self.save_geography_snapshot()
+        if self.watching:
+            self.geography = deepcopy(
+                (
+                    self.aiatsis_geographies,
+                    self.data,
+                    self.errors,
+                    self.gambay_additions,
+                )
+            )
+        with self.metrics.stage("sheet extraction"):
+            self.extract_language_data()
+        if previous:
+            self.previous_errors = previous.build_errors
+            self.rebuild = {
+                code
+                for (root, code) in [
+                    *previous.sheet_codes.items(),
+                    *self.sheet_codes.items(),
+                ]
+                if any(
+                    path == root
+                    or path.startswith(root + os.sep)
+                    or root.startswith(path + os.sep)
+                    for path in changed
+                )
+            }
+            log.info(f"Rebuilding {', '.join(sorted(self.rebuild)) or 'no languages'}")
+        with self.metrics.stage("repository build"):
+            self.build_repository()
+        with self.metrics.stage("index writing"):
+            self.write_master_indices()
+        self.write_json(f"{self.repository}/metrics.json", self.metrics.report())
+        if self.hashed_filenames:
+            self.write_asset_manifest()
+        self.manifest.prune()
+        self.manifest.save()
+
+    def use_repository(self, repository):
+        # everything that is written lives under the repository
+        self.repository = repository
+        self.manifest = BuildManifest(self.repository)
+        self.geography_snapshot = os.path.join(self.repository, ".geography.pickle")
+        self.media_store = os.path.join(self.repository, "media")
+
+    def stage_repository(self):
+        # With STAGED_PUBLISH the published repository is a symlink to one of
+        #  the versions next to it. A build goes into a new version which
+        #  starts as hard links to the files of the published one - every
+        #  write replaces its file rather than rewriting it so the published
+        #  version is never touched and only what changes costs anything.
+        self.versions = os.path.join(
+            os.path.dirname(self.published),
+            f".{os.path.basename(self.published)}-versions",
+        )
+        version = os.path.join(
+            self.versions, datetime.now().strftime("%Y%m%dT%H%M%S.%f")
+        )
+        self.makepath(version)
+        if os.path.isdir(self.published):
+            current = os.path.realpath(self.published)
+            log.info(f"Staging {version} from {current}")
+            for (root, dirs, files) in os.walk(current):
+                target = os.path.join(version, os.path.relpath(root, current))
+                self.makepath(target)
+                for name in files:
+                    try:
+                        os.link(os.path.join(root, name), os.path.join(target, name))
+                    except OSError:
+                        copyfile(os.path.join(root, name), os.path.join(target, name))
+        self.use_repository(version)
+
+    def publish_repository(self):
+        # Renaming a new symlink over the old one swaps the whole repository
+        #  at once. The link is relative so it survives the folder being
+        #  mounted somewhere else (as it is for nginx).
+        link = f"{self.published}.tmp"
+        try:
+            os.remove(link)
+        except FileNotFoundError:
+            pass
+        os.symlink(
+            os.path.relpath(self.repository, os.path.dirname(self.published)), link
+        )
+        if os.path.isdir(self.published) and not os.path.islink(self.published):
+            # the first staged build - the unversioned repository becomes the
+            #  previous version (a directory can't be renamed over)
+            os.rename(
+                self.published,
+                os.path.join(
+                    self.versions,
+                    datetime.fromtimestamp(os.path.getmtime(self.published)).strftime(
+                        "%Y%m%dT%H%M%S.%f"
+                    ),
+                ),
+            )
+        os.replace(link, self.published)
+        log.info(f"Published {self.repository}")
+
+        # keep the last few versions to roll back to
+        versions = sorted(os.listdir(self.versions))
+        for version in versions[: -(self.keep_versions + 1)]:
+            path = os.path.join(self.versions, version)
+            if path != self.repository:
+                log.info(f"Removing version {path}")
+                rmtree(path, ignore_errors=True)
+
+    def geography_key(self):
+        # the snapshot is only valid for the same inputs and the same script
+        return {
+            "aiatsis": self.manifest.file_hash(
+                f"{self.data_path}/AIATSIS-geography.xlsx"
+            ),
+            "gambay": self.manifest.file_hash(self.gambay_geographies_geojson),
+            "script": self.manifest.file_hash(os.path.abspath(__file__)),
+        }
+
+    def load_geography_snapshot(self):
+        # The joined geography (after the mapping and the overrides) is pickled
+        #  in the repository so runs where its inputs haven't changed don't
+        #  have to parse and join them again.
+        if os.environ["UPDATE_ALL"] == "true":
+            return False
+        with self.metrics.stage("geography snapshot"):
+            try:
+                with open(self.geography_snapshot, "rb") as f:
+                    snapshot = pickle.load(f)
+            except FileNotFoundError:
+                return False
+            except Exception as e:
+                log.warning(f"Can't read the geography snapshot ({e}) - rebuilding it")
+                return False
+            if snapshot["key"] != self.geography_key():
+                return False
+            log.info("Geography data is unchanged - using the snapshot")
+            (
+                self.aiatsis_geographies,
+                self.data,
+                self.errors,
+                self.gambay_additions,
+            ) = snapshot["geography"]
+            return True
+
+    def save_geography_snapshot(self):
+        self.makepath(self.repository)
+        snapshot = {
+            "key": self.geography_key(),
+            "geography": (
+                self.aiatsis_geographies,
+                self.data,
+                self.errors,
+                self.gambay_additions,
+            ),
+        }
+        with open(f"{self.geography_snapshot}.tmp", "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{self.geography_snapshot}.tmp", self.geography_snapshot)
+
+    def restore_geography(self, geography):
+        (
+            self.aiatsis_geographies,
+            self.data,
+            self.errors,
+            self.gambay_additions,
+        ) = deepcopy(geography)
 
     def extract_aiatsis_geographies(self):
         def parse_row(row):
@@ -108,6 +1117,7 @@ class DataExtractor:
             }
 
         print("Extracting AIATSIS geography data")
+        self.metrics.read(os.path.getsize(f"{self.data_path}/AIATSIS-geography.xlsx"))
         with xlrd.open_workbook(f"{self.data_path}/AIATSIS-geography.xlsx") as wb:
             sh = wb.sheet_by_index(0)
             for r in range(1, sh.nrows):
@@ -118,6 +1128,7 @@ class DataExtractor:
 
     def extract_gambay_geographies(self):
         print("Extracting Gambay geography data")
+        self.metrics.read(os.path.getsize(self.gambay_geographies_geojson))
         with open(self.gambay_geographies_geojson, "r") as f:
             gambay_data = json.load(f)
 
@@ -212,24 +1223,51 @@ class DataExtractor:
                 }
 
     def extract_language_data(self):
-        def parse_row(row):
-            data = {"english": row[0], "indigenous": row[1].lower()}
-            if ".mov" in row[2]:
-                data["video_file"] = row[2]
-            elif ".wav" in row[2]:
-                data["audio_file"] = row[2]
-
-            if len(row) == 4 and row[3]:
-                data["english_alternate"] = row[3]
-            return data
-
+        folders = []
         for root, dirs, files in os.walk(self.data_path):
             sheet = []
             for file in files:
                 if "xlsx" in file and not "~$" in file:
                     sheet.append(file)
-            if root == "/srv/data":
+            if root == self.data_path:
+                continue
+            folders.append((root, sheet))
+
+        # The extractions go to the sheet cache and are only loaded again one
+        #  at a time - here for their errors and code and then by the build
+        #  (or validate) when it gets to the language.
+        pending = {}
+        script = self.manifest.file_hash(os.path.abspath(__file__))
+        for root, sheet in folders:
+            if len(sheet) != 1:
                 continue
+            sheet = os.path.join(root, sheet[0])
+            digest = self.manifest.file_hash(sheet)
+            current = self.manifest.sheet_current(sheet, digest, script)
+            if os.environ["UPDATE_ALL"] == "true" or not current:
+                pending[sheet] = (root, digest)
+                self.metrics.count("sheets_rebuilt")
+                self.metrics.read(os.path.getsize(sheet))
+            else:
+                log.info(f"{sheet} is unchanged - using the previous extraction")
+                self.metrics.count("sheets_skipped")
+
+        if pending:
+            log.info(
+                f"Reading {len(pending)} spreadsheets with {self.sheet_workers} workers"
+            )
+            with ProcessPoolExecutor(max_workers=self.sheet_workers) as executor:
+                extracted = executor.map(
+                    read_language_sheet,
+                    [root for (root, digest) in pending.values()],
+                    pending.keys(),
+                )
+                for ((sheet, (root, digest)), result) in zip(
+                    pending.items(), extracted
+                ):
+                    self.manifest.record_sheet(sheet, digest, script, result)
+
+        for root, sheet in folders:
             log.info(f"Processing: {root}")
             if len(sheet) > 1:
                 self.errors.append(
@@ -240,168 +1278,182 @@ class DataExtractor:
                     }
                 )
                 continue
-            sheet = sheet[0]
-            sheet = os.path.join(root, sheet)
-            with xlrd.open_workbook(sheet) as wb:
-                sh = wb.sheet_by_index(0)
-                if sh.nrows != 65:
+            if not sheet:
+                # folders inside a language's folder belong to it
+                if os.path.dirname(root) == self.data_path:
                     self.errors.append(
                         {
-                            "type": "Bad spreadsheet",
+                            "type": "No spreadsheet",
                             "level": "error",
-                            "msg": f"'{sheet}' in '{root}' isn't exactly 65 rows - is it correct?",
+                            "msg": f"Found no data spreadsheet in folder '{root}'. Skipping this folder.",
                         }
                     )
-                    continue
+                continue
+            path = os.path.join(root, sheet[0])
+            result = self.manifest.load_sheet(path)
 
-                log.info(f"Verifying {sheet}")
-                v = SheetVerifier(sh, sheet)
-                errors = v.verify()
-                self.errors.extend(errors)
-                if not v.ok:
-                    log.error("Errors found in sheet - skipping this folder.")
-                    continue
+            self.errors.extend(result["errors"])
+            sheet = result["sheet"]
+            if not sheet:
+                continue
+            self.sheet_codes[root] = sheet["code"]
 
-                log.info(f"Extracting language data from {sheet}")
-                sheet = {
-                    "language": {
-                        "name": sh.row_values(0)[1].strip(),
-                        "audio_file": os.path.join(root, sh.row_values(0)[2].strip())
-                        if sh.row_values(0)[2]
-                        else "",
-                    },
-                    "date_received": sh.row_values(6)[1],
-                    "code": sh.row_values(1)[1].strip(),
-                    "words": [],
-                    "speaker": {
-                        "name": sh.row_values(2)[1].strip(),
-                        "audio_file": os.path.join(root, sh.row_values(2)[2].strip())
-                        if sh.row_values(2)[2].strip()
-                        else "",
-                    },
-                    "thankyou": sh.row_values(3)[1].strip(),
-                }
-                if sheet["code"] not in self.data.keys():
-                    try:
-                        if self.aiatsis_geographies[sheet["language"]["name"]]:
-                            aiatsis_data = self.aiatsis_geographies[
-                                sheet["language"]["name"]
-                            ]
-                            self.data[sheet["code"]] = {
-                                "geometry": {
-                                    "coordinates": [
-                                        aiatsis_data["lng"],
-                                        aiatsis_data["lat"],
-                                    ],
-                                    "type": "Point",
-                                },
-                                "properties": {
-                                    "source": "Austlang",
-                                    "code": aiatsis_data["code"],
-                                    "name": aiatsis_data["name"],
-                                },
-                                "type": "Feature",
-                            }
-                            self.errors.append(
-                                {
-                                    "type": "Using Austlang data",
-                                    "level": "warning",
-                                    "msg": f"Using Austlang data for '{sheet['code']}' '{sheet['language']['name']}'",
-                                }
-                            )
-                    except KeyError as e:
+            if sheet["code"] not in self.data.keys():
+                try:
+                    if self.aiatsis_geographies[sheet["language"]["name"]]:
+                        aiatsis_data = self.aiatsis_geographies[
+                            sheet["language"]["name"]
+                        ]
+                        self.data[sheet["code"]] = {
+                            "geometry": {
+                                "coordinates": [
+                                    aiatsis_data["lng"],
+                                    aiatsis_data["lat"],
+                                ],
+                                "type": "Point",
+                            },
+                            "properties": {
+                                "source": "Austlang",
+                                "code": aiatsis_data["code"],
+                                "name": aiatsis_data["name"],
+                            },
+                            "type": "Feature",
+                        }
                         self.errors.append(
                             {
-                                "type": f"Language not found in Gambay or Austlang",
-                                "level": "error",
-                                "msg": f"'{sheet['code']}' '{sheet['language']['name']}' not found in either the Gambay or Austlang data",
+                                "type": "Using Austlang data",
+                                "level": "warning",
+                                "msg": f"Using Austlang data for '{sheet['code']}' '{sheet['language']['name']}'",
                             }
                         )
-                        continue
-
-                for r in range(8, sh.nrows):
-                    data = parse_row(sh.row_values(r))
-                    if "audio_file" in data:
-                        data["audio_file"] = os.path.join(root, data["audio_file"])
-                    elif "video_file" in data:
-                        data["video_file"] = os.path.join(root, data["video_file"])
+                except KeyError as e:
+                    self.errors.append(
+                        {
+                            "type": f"Language not found in Gambay or Austlang",
+                            "level": "error",
+                            "msg": f"'{sheet['code']}' '{sheet['language']['name']}' not found in either the Gambay or Austlang data",
+                        }
+                    )
+                    continue
 
-                    sheet["words"].append(data)
+            self.sheet_paths.setdefault(sheet["code"], path)
 
-                self.data[sheet["code"]]["properties"] = {
-                    **sheet,
-                    **self.data[sheet["code"]]["properties"],
-                }
+    def with_sheet(self, key, item):
+        # the language feature with its sheet's extraction merged in
+        if key in self.sheet_paths:
+            sheet = self.manifest.load_sheet(self.sheet_paths[key])["sheet"]
+            item["properties"] = {**sheet, **item["properties"]}
+        return item
 
     def build_repository(self):
         def get_target_name(path, file, ext):
             return os.path.join(path, os.path.splitext(os.path.basename(file))[0]) + ext
 
-        def transcode(item, target, format):
-            if os.environ["UPDATE_ALL"] == "true" or not os.path.exists(target):
-                log.info(f"Transcoding {item} to {format}")
-                subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-hide_banner",
-                        "-loglevel",
-                        "panic",
-                        "-y",
-                        "-i",
-                        item,
-                        target,
-                    ]
+        transcodes = {}
+        queued = set()
+        links = {}
+
+        # Every unique input and transcode is kept once in the media store under
+        #  a name derived from the content it was made from and the per language
+        #  paths are linked to it. Returns the stored path, its signature and
+        #  whether it still has to be produced.
+        def store(target, signature):
+            (stored, content) = self.media_path(target, signature)
+            target_current = self.manifest.is_current(target, signature, adopt=True)
+            stored_current = self.manifest.is_current(stored, content)
+            links[target] = (stored, signature, target_current)
+            self.makepath(os.path.dirname(stored))
+            if os.environ["UPDATE_ALL"] == "true":
+                return (stored, content, stored not in self.media_produced)
+            if not stored_current and target_current:
+                # built before the media store existed - move it in
+                self.link_or_copy(target, stored)
+                self.manifest.record(stored, content)
+                return (stored, content, False)
+            return (stored, content, not stored_current)
+
+        # Queues one ffmpeg run for whichever of the item's outputs are out of
+        #  date and returns the urls of all of them.
+        def transcode(item, item_path, kind, suffix="", job=None):
+            outputs = []
+            files = []
+            for (format, profile) in self.transcode_profiles.get(kind, {}).items():
+                target = get_target_name(item_path, item, f"{suffix}.{format}")
+                signature = self.manifest.signature(
+                    [item], {"format": format, **profile}
+                )
+                (stored, content, produce) = store(target, signature)
+                files.append(media_url(target, stored))
+                if produce and stored not in queued:
+                    outputs.append((stored, format, content, profile_options(profile)))
+                    queued.add(stored)
+                else:
+                    self.metrics.count("transcodes_skipped")
+            if outputs:
+                # the outputs of a job share the one ffmpeg run (and fail
+                #  together) - optional ones get a job of their own
+                job = transcodes.setdefault(
+                    job or item, (item, ["-i", item], [], item_path)
                 )
+                job[2].extend(outputs)
+            return files
+
+        # with hashed filenames documents refer to the media store directly as
+        #  its names are already derived from the content
+        def media_url(target, stored):
+            return self.url_for(stored if self.hashed_filenames else target)
+
+        def copy_to_repository(item, target):
+            signature = self.manifest.signature([item], "copy")
+            (stored, content, produce) = store(target, signature)
+            if produce and stored not in self.media_produced:
+                copyfile(item, f"{stored}.tmp")
+                os.replace(f"{stored}.tmp", stored)
+                self.manifest.record(stored, content)
+                self.media_produced.add(stored)
+                self.metrics.count("copies_rebuilt")
+                self.metrics.read(os.path.getsize(stored))
+                self.metrics.wrote(os.path.getsize(stored))
+            else:
+                self.metrics.count("copies_skipped")
+            return media_url(target, stored)
 
         def transcode_and_copy_to_repository(item, item_path):
-            if "audio_file" not in item and "video_file" not in item:
-                self.errors.append(
-                    {
-                        "type": "Audio or Video file missing",
-                        "level": "error",
-                        "msg": f"Neither an audio or a video file was provided: '{item_path}' '{item}'",
-                    }
-                )
+            error = self.check_media(item, item_path)
+            if error:
+                self.errors.append(error)
+                if "video_file" in item:
+                    del item["video_file"]
+                    item["video"] = []
+                elif "audio_file" in item:
+                    del item["audio_file"]
+                    item["audio"] = []
                 return item
 
             if "video_file" in item:
                 video_file = item["video_file"]
-                if not os.path.exists(video_file):
-                    self.errors.append(
-                        {
-                            "type": "Video file missing",
-                            "level": "error",
-                            "msg": f"{video_file} not found",
-                        }
-                    )
-                    del item["video_file"]
-                    item["video"] = []
-                    return item
-
-                transcode(
-                    video_file, get_target_name(item_path, video_file, ".webm"), "webm"
-                )
-                transcode(
-                    video_file, get_target_name(item_path, video_file, ".mp4"), "mp4"
-                )
-                video_files = [
-                    get_target_name(item_path, video_file, ".webm").replace(
-                        "/srv/dist", ""
-                    ),
-                    get_target_name(item_path, video_file, ".mp4").replace(
-                        "/srv/dist", ""
-                    ),
-                ]
-                copyfile(
-                    video_file, os.path.join(item_path, os.path.basename(video_file))
-                )
+                video_files = transcode(video_file, item_path, "video")
                 video_files.append(
-                    os.path.join(item_path, os.path.basename(video_file)).replace(
-                        "/srv/dist", ""
+                    copy_to_repository(
+                        video_file,
+                        os.path.join(item_path, os.path.basename(video_file)),
                     )
                 )
 
                 item["video"] = video_files
+                # optional - a job of their own so they can't fail the above
+                extras = (video_file, "extras")
+                poster = transcode(video_file, item_path, "poster", ".poster", extras)
+                if poster:
+                    item["poster"] = poster
+                preview = transcode(
+                    video_file, item_path, "preview", ".preview", extras
+                )
+                if preview:
+                    item["preview"] = preview
+                duration = self.manifest.duration(video_file)
+                if duration is not None:
+                    item["duration"] = round(duration, 3)
                 del item["video_file"]
                 return item
 
@@ -416,40 +1468,12 @@ class DataExtractor:
                 #         }
                 #     )
 
-                if not os.path.exists(audio_file):
-                    self.errors.append(
-                        {
-                            "type": "Audio file missing",
-                            "level": "error",
-                            "msg": f"{audio_file} not found",
-                        }
-                    )
-                    del item["audio_file"]
-                    item["audio"] = []
-                    return item
-
-                transcode(
-                    audio_file, get_target_name(item_path, audio_file, ".webm"), "webm"
-                )
-                transcode(
-                    audio_file, get_target_name(item_path, audio_file, ".mp3"), "mp3"
-                )
-                audio_files = [
-                    get_target_name(item_path, audio_file, ".webm").replace(
-                        "/srv/dist", ""
-                    ),
-                    get_target_name(item_path, audio_file, ".mp3").replace(
-                        "/srv/dist", ""
-                    ),
-                ]
+                audio_files = transcode(audio_file, item_path, "audio")
                 if "wav" in audio_file:
-                    copyfile(
-                        audio_file,
-                        os.path.join(item_path, os.path.basename(audio_file)),
-                    )
                     audio_files.append(
-                        os.path.join(item_path, os.path.basename(audio_file)).replace(
-                            "/srv/dist", ""
+                        copy_to_repository(
+                            audio_file,
+                            os.path.join(item_path, os.path.basename(audio_file)),
                         )
                     )
 
@@ -457,28 +1481,150 @@ class DataExtractor:
                 del item["audio_file"]
                 return item
 
+        # A language's word recordings concatenated in sheet order, each followed
+        #  by a little silence, so a page can load them all in one request.
+        #  Returns the sprite files and where each word starts and ends in them
+        #  (None for words without a recording).
+        def build_sprite(clips, item_path):
+            inputs = []
+            offsets = []
+            offset = 0
+            for clip in clips:
+                duration = None
+                if clip and os.path.exists(clip):
+                    duration = self.manifest.duration(clip)
+                if duration is None:
+                    offsets.append(None)
+                    continue
+                inputs.append(clip)
+                offsets.append([round(offset, 3), round(offset + duration, 3)])
+                offset += duration + self.sprite_padding
+            if not inputs:
+                return None
+
+            # the clips are normalised in the graph as filters can't be added to
+            #  its outputs
+            profiles = self.transcode_profiles["audio"]
+            loudnorm = [p["loudnorm"] for p in profiles.values() if p.get("loudnorm")]
+            files = []
+            outputs = []
+            for (format, profile) in profiles.items():
+                target = os.path.join(item_path, f"words-sprite.{format}")
+                signature = self.manifest.signature(
+                    inputs,
+                    {
+                        "sprite": format,
+                        "padding": self.sprite_padding,
+                        "order": [self.manifest.file_hash(clip) for clip in inputs],
+                        "loudnorm": loudnorm[:1],
+                        **profile,
+                    },
+                )
+                (stored, content, produce) = store(target, signature)
+                files.append(media_url(target, stored))
+                if produce and stored not in queued:
+                    options = profile_options(profile, f"[s{len(outputs)}]")
+                    outputs.append((stored, format, content, options))
+                    queued.add(stored)
+                else:
+                    self.metrics.count("transcodes_skipped")
+
+            if outputs:
+                options = []
+                graph = ""
+                for (i, clip) in enumerate(inputs):
+                    options += ["-i", clip]
+                    graph += f"[{i}:a:0]"
+                    if loudnorm:
+                        graph += f"loudnorm={loudnorm[0]},"
+                    graph += (
+                        f"aresample=44100,aformat=channel_layouts=mono,"
+                        f"apad=pad_len={int(self.sprite_padding * 44100)}[a{i}];"
+                    )
+                graph += "".join(f"[a{i}]" for i in range(len(inputs)))
+                graph += f"concat=n={len(inputs)}:v=0:a=1,asplit={len(outputs)}"
+                graph += "".join(f"[s{i}]" for i in range(len(outputs)))
+                options += ["-filter_complex", graph]
+                transcodes[item_path] = (item_path, options, outputs, item_path)
+            return {"audio": files, "words": offsets}
+
+        # Each language is released once its index.json has been written. What
+        #  the master indices need from it is spilled to disk: its languages.json
+        #  entry (self.languages maps the code to where that is in the spill
+        #  file) and its entry in each word (self.words maps the english word to
+        #  the name of a spill file holding the entries, one per line).
+        #  With the compact schema an entry only names its language - the
+        #  client joins it back up with the language from languages.json.
         def push_to_words(word, item):
             item = {**item}
             if word["english"] not in self.words:
-                self.words[word["english"]] = []
+                m = hashlib.sha256()
+                m.update(word["english"].encode())
+                self.words[word["english"]] = m.hexdigest()
             word["language"] = {
                 "code": item["properties"]["code"],
                 "name": item["properties"]["name"],
             }
             item["properties"] = word
+            if self.compact_words:
+                item = {
+                    "language": word["language"]["code"],
+                    "properties": {k: v for k, v in word.items() if k != "language"},
+                }
             # pp.pprint(item)
-            self.words[word["english"]].append(item)
+            spill = os.path.join(self.spill.name, self.words[word["english"]])
+            with open(spill, "ab") as f:
+                f.write(json.dumps(item).encode() + b"\n")
+
+        def spill_language(code, item):
+            self.languages[code] = languages.tell()
+            summary = {
+                **item,
+                "properties": {
+                    **item["properties"],
+                    "words": True if "words" in item["properties"] else False,
+                },
+            }
+            languages.write(json.dumps(summary).encode() + b"\n")
 
         self.makepath(self.repository)
-        for key, item in self.data.items():
+        self.spill = tempfile.TemporaryDirectory(prefix="extract-data-")
+        languages = open(os.path.join(self.spill.name, "languages"), "wb")
+        reused = set()
+        for key in list(self.data):
+            item = self.with_sheet(key, self.data.pop(key))
             item_geometry = SimpleNamespace(**item["geometry"])
             item_properties = SimpleNamespace(**item["properties"])
+            item_path = os.path.join(self.repository, item_properties.code)
+            index = os.path.join(item_path, "index.json")
+
+            # in watch mode only the languages whose folder changed are rebuilt
+            #  - the rest are read back from the repository
+            if (
+                self.rebuild is not None
+                and key not in self.rebuild
+                and os.path.exists(index)
+            ):
+                with open(index, "rb") as f:
+                    content = f.read()
+                item = json.loads(content)
+                if self.hashed_filenames:
+                    hashed = self.hashed_name(index, hashlib.sha256(content).hexdigest())
+                    self.assets[self.url_for(index)] = self.url_for(hashed)
+                reused.add(item_properties.code)
+                self.build_errors[item_properties.code] = self.previous_errors.get(
+                    item_properties.code, []
+                )
+                self.errors.extend(self.build_errors[item_properties.code])
+                for (slot, word) in enumerate(item["properties"].get("words", [])):
+                    self.search.add(item_properties.code, slot, word)
+                    push_to_words(word, item)
+                spill_language(item_properties.code, item)
+                continue
 
             log.info(f"Building repository for {item_properties.code}")
-            item_path = os.path.join(self.repository, item_properties.code)
             self.makepath(item_path)
-
-            self.languages[item_properties.code] = item
+            mark = len(self.errors)
 
             if "speaker" in item["properties"]:
                 item["properties"]["speaker"] = transcode_and_copy_to_repository(
@@ -493,18 +1639,233 @@ class DataExtractor:
                 # pp.pprint(item["properties"]["language"])
 
             if "words" in item["properties"]:
+                clips = [word.get("audio_file") for word in item_properties.words]
                 words = []
-                for word in item_properties.words:
+                for (slot, word) in enumerate(item_properties.words):
                     word = transcode_and_copy_to_repository(word, item_path)
+                    self.search.add(item_properties.code, slot, word)
                     # pp.pprint(word)
                     push_to_words(word, item)
                     words.append(word)
                 item["properties"]["words"] = words
+                if self.audio_sprites:
+                    sprite = build_sprite(clips, item_path)
+                    if sprite:
+                        item["properties"]["sprite"] = sprite
                 # pp.pprint(item["properties"]["words"])
 
             # pp.pprint(item)
-            with open(os.path.join(item_path, "index.json"), "w") as f:
-                f.write(json.dumps(item))
+            self.write_json(index, item)
+            self.build_errors[item_properties.code] = self.errors[mark:]
+            spill_language(item_properties.code, item)
+
+        languages.close()
+        self.claim(reused)
+        self.run_transcodes(transcodes)
+        self.link_media(links)
+
+    def check_media(self, item, item_path):
+        # the error for a speaker, language or word whose recording is missing
+        if "audio_file" not in item and "video_file" not in item:
+            return {
+                "type": "Audio or Video file missing",
+                "level": "error",
+                "msg": f"Neither an audio or a video file was provided: '{item_path}' '{item}'",
+            }
+        if "video_file" in item:
+            if not os.path.exists(item["video_file"]):
+                return {
+                    "type": "Video file missing",
+                    "level": "error",
+                    "msg": f"{item['video_file']} not found",
+                }
+        elif not os.path.exists(item["audio_file"]):
+            return {
+                "type": "Audio file missing",
+                "level": "error",
+                "msg": f"{item['audio_file']} not found",
+            }
+
+    def validate(self):
+        # Only the checks: the sheets (read in parallel), the geography codes and
+        #  that every recording exists. Nothing is written to the repository and
+        #  ffmpeg isn't run.
+        self.manifest.read_only = True
+        self.manifest.load()
+        if not self.load_geography_snapshot():
+            self.extract_aiatsis_geographies()
+            self.extract_gambay_geographies()
+            self.map_gambay_and_aiatsis_geographies()
+            self.apply_aiatsis_overrides()
+        self.extract_language_data()
+        for (key, item) in self.data.items():
+            item = self.with_sheet(key, dict(item))
+            properties = item["properties"]
+            item_path = os.path.join(self.repository, properties["code"])
+            recordings = [
+                properties[kind] for kind in ["speaker", "language"] if kind in properties
+            ]
+            for recording in recordings + properties.get("words", []):
+                error = self.check_media(recording, item_path)
+                if error:
+                    self.errors.append(error)
+        return {
+            "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "errors": self.errors,
+        }
+
+    def media_path(self, target, signature):
+        content = {
+            "inputs": sorted(signature["inputs"].values()),
+            "settings": signature["settings"],
+        }
+        key = hashlib.sha256(json.dumps(content).encode()).hexdigest()
+        stored = os.path.join(
+            self.media_store, key[:2], key + os.path.splitext(target)[1]
+        )
+        return (stored, content)
+
+    def claim(self, codes):
+        # keeps the outputs of languages that weren't rebuilt (and the media
+        #  and input hashes they use) from being pruned
+        for (key, signature) in list(self.manifest.outputs.items()):
+            if key.split(os.sep)[0] not in codes:
+                continue
+            self.manifest.seen_outputs.add(key)
+            if not signature["inputs"]:
+                continue
+            self.manifest.seen_files.update(signature["inputs"])
+            (stored, content) = self.media_path(
+                os.path.join(self.repository, key), signature
+            )
+            self.manifest.seen_outputs.add(os.path.relpath(stored, self.repository))
+
+    def link_media(self, links):
+        for target, (stored, signature, current) in links.items():
+            if not os.path.exists(stored):
+                # the transcode failed and has been reported already
+                self.manifest.forget(target)
+                continue
+            if current and stored not in self.media_produced:
+                self.metrics.count("links_skipped")
+                continue
+            self.link_or_copy(stored, target)
+            self.manifest.record(target, signature)
+            self.metrics.count("links_rebuilt")
+
+    def link_or_copy(self, source, target):
+        # prefer a hard link, then a reflink (FICLONE) on filesystems that
+        #  support them and fall back to a copy
+        if os.path.exists(target) and os.path.samefile(source, target):
+            # already linked - renaming a link over itself would do nothing
+            return
+        tmp = f"{target}.tmp"
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(source, tmp)
+        except OSError:
+            try:
+                with open(source, "rb") as s, open(tmp, "wb") as t:
+                    fcntl.ioctl(t.fileno(), FICLONE, s.fileno())
+            except OSError:
+                copyfile(source, tmp)
+        os.replace(tmp, target)
+
+    def run_transcodes(self, transcodes):
+        # each job is an input with all of the outputs that are to be made
+        #  from it in the one ffmpeg run. ffmpeg writes next to each target
+        #  (keeping the extension it picks the muxer from) and the target is
+        #  then replaced, never rewritten in place.
+        def partial(target):
+            (root, ext) = os.path.splitext(target)
+            return f"{root}.tmp{ext}"
+
+        def run(job):
+            (item, options, outputs, item_path) = job
+            formats = ", ".join(format for (target, format, *rest) in outputs)
+            log.info(f"Transcoding {item} to {formats}")
+            args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + options
+            for (target, format, signature, output) in outputs:
+                args += output + [partial(target)]
+            start = time.perf_counter()
+            try:
+                result = subprocess.run(
+                    args,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
+            except OSError as e:
+                result = subprocess.CompletedProcess(args, -1, stderr=str(e).encode())
+            self.metrics.transcode(
+                item,
+                formats,
+                time.perf_counter() - start,
+                result.returncode,
+                sum(
+                    os.path.getsize(options[i + 1])
+                    for (i, option) in enumerate(options)
+                    if option == "-i"
+                ),
+                sum(
+                    os.path.getsize(partial(target))
+                    for (target, *rest) in outputs
+                    if os.path.exists(partial(target))
+                ),
+            )
+            return result
+
+        jobs = list(transcodes.values())
+        outputs = sum(len(job[2]) for job in jobs)
+        log.info(
+            f"Transcoding {outputs} files in {len(jobs)} runs with {self.transcode_workers} workers"
+        )
+        self.metrics.count("transcodes_rebuilt", outputs)
+        with ThreadPoolExecutor(max_workers=self.transcode_workers) as executor:
+            results = executor.map(run, jobs)
+            for ((item, options, outputs, item_path), result) in zip(jobs, results):
+                formats = ", ".join(format for (target, format, *rest) in outputs)
+                stderr = result.stderr.decode(errors="replace").strip()
+                if result.returncode != 0:
+                    for (target, *rest) in outputs:
+                        self.manifest.forget(target)
+                        for path in [partial(target), target]:
+                            try:
+                                os.remove(path)
+                            except FileNotFoundError:
+                                pass
+                    error = {
+                        "type": "Transcoding failed",
+                        "level": "error",
+                        "msg": f"ffmpeg exited with status {result.returncode} transcoding '{item}' to {formats}: {stderr}",
+                    }
+                    self.errors.append(error)
+                    self.build_errors.setdefault(
+                        os.path.relpath(item_path, self.repository), []
+                    ).append(error)
+                    continue
+
+                for (target, format, signature, output) in outputs:
+                    os.replace(partial(target), target)
+                    self.manifest.record(target, signature)
+                    self.media_produced.add(target)
+                if stderr:
+                    error = {
+                        "type": "Transcoding warning",
+                        "level": "warning",
+                        "msg": f"ffmpeg reported problems transcoding '{item}' to {formats}: {stderr}",
+                    }
+                    self.errors.append(error)
+                    self.build_errors.setdefault(
+                        os.path.relpath(item_path, self.repository), []
+                    ).append(error)
+
+    def url_for(self, path):
+        # the repository is served as /repository
+        return "/repository/" + os.path.relpath(path, self.repository)
 
     def makepath(self, path):
         try:
@@ -512,49 +1873,404 @@ class DataExtractor:
         except:
             pass
 
-    def write_master_indices(self):
-        languages = []
-        for (code, language) in self.languages.items():
-            language["properties"]["words"] = (
-                True if "words" in language["properties"] else False
+    def write_json(self, path, data, hashed=True):
+        self.write_file(path, json.dumps(data).encode(), hashed=hashed)
+
+    def write_file(self, path, content, compress=True, hashed=True):
+        self.write_stream(path, [content], compress, hashed)
+
+    def write_stream(self, path, chunks, compress=True, hashed=True):
+        # The content goes to a temporary file as it's produced so it never has
+        #  to be held in memory as a whole and is only kept if it has changed.
+        #  nginx serves the precompressed siblings via gzip_static. Everything
+        #  is replaced rather than rewritten in place as the hashed names are
+        #  links to the same files.
+        m = hashlib.sha256()
+        with open(f"{path}.tmp", "wb") as f:
+            for chunk in chunks:
+                m.update(chunk)
+                f.write(chunk)
+        signature = self.manifest.signature([], m.hexdigest())
+        targets = [path]
+        if compress:
+            targets.append(f"{path}.gz")
+        if compress and self.brotli:
+            targets.append(f"{path}.br")
+        current = [self.manifest.is_current(target, signature) for target in targets]
+        if all(current):
+            os.remove(f"{path}.tmp")
+            self.metrics.count("files_skipped")
+            if hashed:
+                self.write_hashed(targets, signature)
+            return
+        self.metrics.count("files_rebuilt")
+
+        compressors = []
+        if compress:
+            compressors.append(
+                (
+                    f"{path}.gz",
+                    zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+                )
             )
-            languages.append(language)
+        if compress and self.brotli:
+            compressors.append((f"{path}.br", brotli.Compressor(quality=11)))
+        for target, compressor in compressors:
+            with open(f"{path}.tmp", "rb") as f, open(f"{target}.tmp", "wb") as out:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    out.write(compressor.compress(chunk))
+                out.write(compressor.flush())
+                self.metrics.wrote(out.tell())
+            os.replace(f"{target}.tmp", target)
+        self.metrics.wrote(os.path.getsize(f"{path}.tmp"))
+        os.replace(f"{path}.tmp", path)
+        for target in targets:
+            self.manifest.record(target, signature)
+        if hashed:
+            self.write_hashed(targets, signature)
+
+    def hashed_name(self, path, digest):
+        (root, ext) = os.path.splitext(path)
+        return f"{root}.{digest[:16]}{ext}"
+
+    def write_hashed(self, targets, signature):
+        # With HASHED_FILENAMES the file (and its compressed siblings) is also
+        #  linked under a name that includes its content hash so it can be
+        #  cached for ever. asset-manifest.json maps the names to them.
+        if not self.hashed_filenames:
+            return
+        path = targets[0]
+        hashed = self.hashed_name(path, signature["settings"])
+        self.assets[self.url_for(path)] = self.url_for(hashed)
+        for target in targets:
+            hashed_target = hashed + target[len(path) :]
+            if not self.manifest.is_current(hashed_target, signature):
+                self.link_or_copy(target, hashed_target)
+                self.manifest.record(hashed_target, signature)
+
+    def write_asset_manifest(self):
+        # the hashed files of the previous run (and the media they refer to)
+        #  are kept for one more so that clients still holding its manifest
+        #  can fetch them
+        store = os.path.relpath(self.media_store, self.repository) + os.sep
+        media = sorted(
+            key for key in self.manifest.seen_outputs if key.startswith(store)
+        )
+        for key in self.manifest.media:
+            if key in self.manifest.outputs:
+                self.manifest.seen_outputs.add(key)
+        self.manifest.media = media
+        try:
+            with open(f"{self.repository}/asset-manifest.json", "r") as f:
+                previous = json.load(f)["assets"]
+        except (FileNotFoundError, ValueError, KeyError):
+            previous = {}
+        for url in previous.values():
+            path = os.path.join(self.repository, os.path.relpath(url, "/repository"))
+            for target in [path, f"{path}.gz", f"{path}.br"]:
+                key = os.path.relpath(target, self.repository)
+                if key in self.manifest.outputs:
+                    self.manifest.seen_outputs.add(key)
+        self.write_json(
+            f"{self.repository}/asset-manifest.json",
+            {"assets": dict(sorted(self.assets.items()))},
+            hashed=False,
+        )
+
+    def spilled_languages(self):
+        with open(os.path.join(self.spill.name, "languages"), "rb") as f:
+            for offset in self.languages.values():
+                f.seek(offset)
+                yield f.readline().rstrip(b"\n")
+
+    def write_master_indices(self):
+        def languages():
+            yield b'{"languages": ['
+            for (i, language) in enumerate(self.spilled_languages()):
+                yield b", " + language if i else language
+            yield b"]}"
 
-        with open(f"{self.repository}/languages.json", "w") as f:
-            f.write(json.dumps({"languages": languages}))
+        self.write_stream(f"{self.repository}/languages.json", languages())
+        self.write_tiles()
 
+        # The word documents are also packed into one bundle (a json array) and
+        #  words.json records where each one is so a client can fetch a single
+        #  word with a Range request or the whole lot at once. It isn't
+        #  precompressed as the offsets have to be into the file as served.
         words = []
-        for (key, word) in self.words.items():
-            m = hashlib.sha256()
-            m.update(key.encode())
-            index = m.hexdigest()
-            words.append({"name": key, "index": f"{index}.json"})
-            with open(f"{self.repository}/{index}.json", "w") as f:
-                f.write(json.dumps(word))
-
-        with open(f"{self.repository}/words.json", "w") as f:
-            f.write(json.dumps({"words": words}))
-
-        with open(f"{self.repository}/errors.json", "w") as f:
-            f.write(
-                json.dumps(
+
+        def bundle():
+            offset = 1
+            yield b"["
+            for (key, index) in self.words.items():
+                with open(os.path.join(self.spill.name, index), "rb") as f:
+                    content = b"[" + b", ".join(l.rstrip(b"\n") for l in f) + b"]"
+                self.write_file(f"{self.repository}/{index}.json", content)
+                words.append(
                     {
-                        "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "errors": self.errors,
+                        "name": key,
+                        "index": f"{index}.json",
+                        "offset": offset,
+                        "length": len(content),
                     }
                 )
+                yield b"," + content if offset > 1 else content
+                offset += len(content) + 1
+            yield b"]"
+
+        self.write_stream(f"{self.repository}/words.bundle", bundle(), compress=False)
+        self.write_json(f"{self.repository}/words.json", {"words": words})
+        self.write_json(
+            f"{self.repository}/transcode-profiles.json", self.transcode_profiles
+        )
+        self.write_search_index()
+
+        self.write_json(
+            f"{self.repository}/errors.json",
+            {
+                "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "errors": self.errors,
+            },
+        )
+        self.write_json(
+            f"{self.repository}/gambay-additions.json",
+            {
+                "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "additions": self.gambay_additions,
+            },
+        )
+        self.write_corpus_database()
+        self.spill.cleanup()
+
+    def write_corpus_database(self):
+        # The whole corpus in one indexed SQLite database for the admin views
+        #  and ad-hoc queries, e.g. the languages without a video for a word:
+        #  SELECT code FROM languages WHERE code NOT IN (SELECT language FROM
+        #  media WHERE english = 'fire' AND kind = 'video')
+        # It's built from scratch in bulk next to the served one (which is
+        #  read only) and only replaces it if it has changed.
+        path = f"{self.repository}/corpus.sqlite"
+        try:
+            os.remove(f"{path}.tmp")
+        except FileNotFoundError:
+            pass
+        db = sqlite3.connect(f"{path}.tmp")
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(
+            """
+            CREATE TABLE languages (
+                code TEXT, name TEXT, source TEXT, date_received TEXT,
+                speaker TEXT, thankyou TEXT, words INTEGER,
+                properties TEXT, geometry TEXT
+            );
+            CREATE TABLE words (
+                language TEXT, english TEXT, indigenous TEXT,
+                english_alternate TEXT, properties TEXT
+            );
+            CREATE TABLE media (
+                language TEXT, english TEXT, role TEXT, kind TEXT, url TEXT
+            );
+            CREATE TABLE errors (type TEXT, level TEXT, msg TEXT);
+            CREATE TABLE gambay_additions (property TEXT, value TEXT, name TEXT);
+            """
+        )
+
+        def media(code, english, role, properties):
+            for kind in ["audio", "video", "poster", "preview"]:
+                for url in properties.get(kind) or []:
+                    yield (code, english, role, kind, url)
+
+        with db:
+            for language in self.spilled_languages():
+                language = json.loads(language)
+                properties = language["properties"]
+                code = properties.get("code")
+                db.execute(
+                    "INSERT INTO languages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        code,
+                        properties.get("name"),
+                        properties.get("source"),
+                        properties.get("date_received"),
+                        (properties.get("speaker") or {}).get("name"),
+                        properties.get("thankyou"),
+                        properties.get("words", False),
+                        json.dumps(properties),
+                        json.dumps(language.get("geometry")),
+                    ),
+                )
+                for role in ["language", "speaker"]:
+                    db.executemany(
+                        "INSERT INTO media VALUES (?, ?, ?, ?, ?)",
+                        media(code, None, role, properties.get(role) or {}),
+                    )
+
+            for index in self.words.values():
+                with open(os.path.join(self.spill.name, index), "rb") as f:
+                    for line in f:
+                        word = json.loads(line)
+                        properties = word["properties"]
+                        code = (
+                            word["language"]
+                            if self.compact_words
+                            else properties["language"]["code"]
+                        )
+                        db.execute(
+                            "INSERT INTO words VALUES (?, ?, ?, ?, ?)",
+                            (
+                                code,
+                                properties.get("english"),
+                                properties.get("indigenous"),
+                                properties.get("english_alternate"),
+                                json.dumps(properties),
+                            ),
+                        )
+                        db.executemany(
+                            "INSERT INTO media VALUES (?, ?, ?, ?, ?)",
+                            media(code, properties.get("english"), "word", properties),
+                        )
+
+            db.executemany(
+                "INSERT INTO errors VALUES (?, ?, ?)",
+                [(e["type"], e["level"], e["msg"]) for e in self.errors],
             )
-        with open(f"{self.repository}/gambay-additions.json", "w") as f:
-            f.write(
-                json.dumps(
-                    {
-                        "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "additions": self.gambay_additions,
+            db.executemany(
+                "INSERT INTO gambay_additions VALUES (?, ?, ?)",
+                [
+                    (a.get("property"), a.get("value"), a.get("name"))
+                    for a in self.gambay_additions
+                ],
+            )
+
+        # indexes are quicker to build once the rows are in
+        with db:
+            db.executescript(
+                """
+                CREATE INDEX languages_code ON languages (code);
+                CREATE INDEX words_language ON words (language);
+                CREATE INDEX words_english ON words (english);
+                CREATE INDEX media_language ON media (language, english);
+                CREATE INDEX media_english ON media (english, kind);
+                CREATE INDEX errors_type ON errors (type);
+                CREATE INDEX gambay_additions_property ON gambay_additions (property);
+                """
+            )
+        db.close()
+
+        m = hashlib.sha256()
+        with open(f"{path}.tmp", "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                m.update(chunk)
+        signature = self.manifest.signature([], m.hexdigest())
+        if self.manifest.is_current(path, signature):
+            os.remove(f"{path}.tmp")
+            self.metrics.count("files_skipped")
+        else:
+            self.metrics.count("files_rebuilt")
+            self.metrics.wrote(os.path.getsize(f"{path}.tmp"))
+            os.chmod(f"{path}.tmp", 0o444)
+            os.replace(f"{path}.tmp", path)
+            self.manifest.record(path, signature)
+        self.write_hashed([path], signature)
+
+    def write_tiles(self):
+        # Languages bucketed into slippy map tiles at each zoom level with their
+        #  geometry simplified to about a pixel (256px tiles) and coordinates
+        #  rounded to match so the map only needs to fetch what's visible.
+        index = {"zooms": self.tile_zooms, "tiles": {}}
+        for zoom in self.tile_zooms:
+            tolerance = 360 / (256 * 2 ** zoom)
+            precision = max(0, math.ceil(-math.log10(tolerance)))
+            tiles = {}
+            for language in self.spilled_languages():
+                language = json.loads(language)
+                try:
+                    bounds = geometry_bounds(language["geometry"]["coordinates"])
+                    geometry = simplify_geometry(
+                        language["geometry"], tolerance, precision
+                    )
+                except (KeyError, TypeError, IndexError):
+                    continue
+                if not bounds:
+                    continue
+                if not geometry:
+                    # too small to draw at this zoom - keep it visible as a point
+                    centre = [(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2]
+                    geometry = {
+                        "type": "Point",
+                        "coordinates": quantize_line([centre], precision)[0],
                     }
+
+                feature = {
+                    "type": "Feature",
+                    "geometry": geometry,
+                    "properties": {
+                        key: language["properties"][key]
+                        for key in ["code", "name", "source", "words"]
+                        if key in language["properties"]
+                    },
+                }
+                (west, north) = tile_at(bounds[0], bounds[3], zoom)
+                (east, south) = tile_at(bounds[2], bounds[1], zoom)
+                for x in range(west, east + 1):
+                    for y in range(north, south + 1):
+                        tiles.setdefault((x, y), []).append(feature)
+
+            index["tiles"][zoom] = []
+            for (x, y), features in sorted(tiles.items()):
+                path = os.path.join(self.repository, "tiles", str(zoom), str(x))
+                self.makepath(path)
+                self.write_json(
+                    os.path.join(path, f"{y}.json"),
+                    {"type": "FeatureCollection", "features": features},
                 )
-            )
+                index["tiles"][zoom].append([x, y, len(features)])
+        self.write_json(os.path.join(self.repository, "tiles", "index.json"), index)
+
+    def write_search_index(self):
+        path = os.path.join(self.repository, "search")
+        self.makepath(path)
+        shards = self.search.shards()
+        for key, shard in shards.items():
+            self.write_json(os.path.join(path, f"{key}.json"), shard)
+        self.write_json(
+            os.path.join(path, "index.json"),
+            {
+                "languages": self.search.languages,
+                "fields": self.search.fields,
+                "ngram": self.search.ngram,
+                "shards": {
+                    key: len(shard["tokens"]) + len(shard["ngrams"])
+                    for key, shard in sorted(shards.items())
+                },
+            },
+        )
 
 
 if __name__ == "__main__":
+    if "--watch" in sys.argv:
+        watch()
+    if "--validate" in sys.argv:
+        os.environ.setdefault("UPDATE_ALL", "false")
+        d = DataExtractor()
+        # the extraction prints progress - keep stdout for the errors
+        with redirect_stdout(sys.stderr):
+            report = d.validate()
+        print(json.dumps(report, indent=4))
+        sys.exit(1 if any(e["level"] == "error" for e in report["errors"]) else 0)
     d = DataExtractor()
-    d.extract()
+    profiler = os.environ.get("PROFILE")
+    if profiler == "cprofile":
+        cProfile.run("d.extract()", f"{d.repository}/.profile.prof")
+    elif profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        p = Profiler()
+        p.start()
+        d.extract()
+        p.stop()
+        with open(f"{d.repository}/.profile.html", "w") as f:
+            f.write(p.output_html())
+    else:
+        d.extract()
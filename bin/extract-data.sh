@@ -1,7 +1,7 @@
 #!/bin/bash
 
 apt-get update && apt-get install -y ffmpeg
-pip install xlrd coloredlogs
+pip install xlrd coloredlogs brotli
 python3 --version
 wget --quiet -O ${DATA_50WORDS}/gambay-languages.geojson https://gambay.com.au/gambay-languages.geojson
-python3 -u ./bin/extract-data.py
\ No newline at end of file
+python3 -u ./bin/extract-data.py $WATCH
\ No newline at end of file
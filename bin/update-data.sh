@@ -1,6 +1,7 @@
 #!/bin/bash
 
 [[ "$2" == "--update-all" ]] && export UPDATE_ALL=true
+[[ "$2" == "--watch" ]] && export WATCH=--watch
 if [ "$1" == "--prod" ] ; then
     export DATA_50WORDS="/srv/data"
     export REPOSITORY_50WORDS="/srv/50words.online"
@@ -10,7 +11,7 @@ elif [ "$1" == "--dev" ] ; then
     export REPOSITORY_50WORDS="./dist"
     docker-compose up
 else
-    echo "Usage: $0 [ --prod | --dev ] [ --update-all ]"
+    echo "Usage: $0 [ --prod | --dev ] [ --update-all | --watch ]"
 fi
 
 
@@ -2,13 +2,36 @@
 
 import { compact, orderBy } from "lodash";
 
+// the content hashed names of the repository's files - only there if it was
+//  built with HASHED_FILENAMES, in which case everything but the manifest can
+//  be cached for ever
+let assets = {};
+let assetsLoaded;
+
+function loadAssets() {
+    if (!assetsLoaded) {
+        assetsLoaded = fetch(mapRepositoryRoot("/repository/asset-manifest.json"))
+            .then(response =>
+                response.status === 200 ? response.json() : { assets: {} }
+            )
+            .then(manifest => {
+                assets = manifest.assets;
+            })
+            .catch(error => console.log(error));
+    }
+    return assetsLoaded;
+}
+
 export async function loadData({ store }) {
-    const words = (await get(mapRepositoryRoot("/repository/words.json")))
-        .words;
-    store.commit(`setWords`, { words });
-    let languages = (await get(mapRepositoryRoot("/repository/languages.json")))
-        .languages;
-    store.commit(`setLanguages`, { languages });
+    await loadAssets();
+    // languages go in first - compact words are joined up with them as soon
+    //  as there are words to load
+    const [words, languages] = await Promise.all([
+        get(mapRepositoryRoot("/repository/words.json")),
+        get(mapRepositoryRoot("/repository/languages.json"))
+    ]);
+    store.commit(`setLanguages`, { languages: languages.languages });
+    store.commit(`setWords`, { words: words.words });
 
     async function get(path) {
         try {
@@ -25,6 +48,7 @@ export async function loadData({ store }) {
 }
 
 export async function loadLanguageData({ code }) {
+    await loadAssets();
     let response = await fetch(
         mapRepositoryRoot(`/repository/${code}/index.json`)
     );
@@ -38,18 +62,91 @@ export async function loadLanguageData({ code }) {
             audio: mapRepositoryRoot(w.audio)
         };
     });
+
+    // with audio sprites each word plays its slice of one shared recording
+    const sprite = data.properties.sprite;
+    if (sprite) {
+        const audio = sprite.audio.map(mapRepositoryRoot);
+        data.properties.words.forEach((w, idx) => {
+            if (!sprite.words[idx]) return;
+            w.sprite = {
+                audio,
+                start: sprite.words[idx][0],
+                end: sprite.words[idx][1]
+            };
+        });
+    }
     return data;
 }
 
-export async function loadWordData({ word, words }) {
-    let index = words.filter(w => {
-        return w.name === word;
-    })[0].index;
-    let response = await fetch(mapRepositoryRoot(`/repository/${index}`));
-    if (response.status !== 200) {
-        throw new Error(response);
+const wordIndexes = new WeakMap();
+const languageIndexes = new WeakMap();
+
+export async function loadWordData({ word, words, languages }) {
+    await loadAssets();
+    if (!wordIndexes.has(words)) {
+        wordIndexes.set(words, new Map(words.map(w => [w.name, w])));
+    }
+    const entry = wordIndexes.get(words).get(word);
+
+    // fetch just this word out of the bundle if the server supports range
+    //  requests - otherwise (or if the slice doesn't parse) fall back to the
+    //  word's own file
+    word = undefined;
+    if (entry.length) {
+        const controller = new AbortController();
+        const end = entry.offset + entry.length - 1;
+        const response = await fetch(
+            mapRepositoryRoot(`/repository/words.bundle`),
+            {
+                headers: { Range: `bytes=${entry.offset}-${end}` },
+                signal: controller.signal
+            }
+        );
+        if (response.status === 206) {
+            try {
+                word = await response.json();
+            } catch (error) {
+                console.log(error);
+            }
+        } else {
+            // a server that ignores the range sends the whole bundle - stop it
+            controller.abort();
+        }
     }
-    word = await response.json();
+    if (!word) {
+        const response = await fetch(
+            mapRepositoryRoot(`/repository/${entry.index}`)
+        );
+        if (response.status !== 200) {
+            throw new Error(response);
+        }
+        word = await response.json();
+    }
+
+    // compact word files only name the language - put the language feature
+    //  back around the word so it looks the same either way
+    if (!languageIndexes.has(languages)) {
+        languageIndexes.set(
+            languages,
+            new Map(languages.map(l => [l.properties.code, l]))
+        );
+    }
+    word = compact(word.map(w => {
+        if (typeof w.language !== "string") return w;
+        const language = languageIndexes.get(languages).get(w.language);
+        if (!language) return undefined;
+        return {
+            ...language,
+            properties: {
+                ...w.properties,
+                language: {
+                    code: language.properties.code,
+                    name: language.properties.name
+                }
+            }
+        };
+    }));
     word = word.map(w => {
         return {
             ...w,
@@ -60,6 +157,7 @@ export async function loadWordData({ word, words }) {
 }
 
 export async function loadProcessingData() {
+    await loadAssets();
     let response = await fetch(mapRepositoryRoot(`/repository/errors.json`));
     if (response.status !== 200) {
         throw new Error(response);
@@ -73,10 +171,15 @@ export async function loadProcessingData() {
         throw new Error(response);
     }
     const additions = await response.json();
-    return { errors, additions };
+
+    // older repositories don't have metrics
+    response = await fetch(mapRepositoryRoot(`/repository/metrics.json`));
+    const metrics = response.status === 200 ? await response.json() : undefined;
+    return { errors, additions, metrics };
 }
 
 export function mapRepositoryRoot(path) {
+    path = assets[path] || path;
     return path;
     const root =
         process.env.NODE_ENV === "development"
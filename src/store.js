@@ -51,6 +51,7 @@ const configuration = {
         async loadWord({ state, commit }, payload) {
             const word = await loadWordData({
                 words: state.words,
+                languages: state.languages,
                 word: payload.word
             });
             commit("setSelectedWord", { word });